@@ -1,20 +1,25 @@
 import torch
-import numpy as np
-import torch.nn.functional as F
-from typing import Optional
+from typing import List, Optional, Union
 from scripts.model import Model
 from scripts.tokenizer import ByteTokenizer
 
+@torch.inference_mode()
 def generate(
         model: Model,
         tokenizer: ByteTokenizer,
+        prompts: Optional[List[str]] = None,
         temperature: float = 1.0,
         top_k: Optional[int] = None,
-        max_length: int = 1024
-) -> str:
+        max_length: int = 1024,
+        compile_step: bool = False
+) -> Union[str, List[str]]:
     """
     Функция для генерации текста с использованием модели и токенизатора.
 
+    Поддерживает батчевую генерацию: несколько затравок (prompts) обрабатываются
+    параллельно одним проходом модели на каждый шаг, так что накладные расходы
+    на шаг (цикл Python, вызов модели) делятся на размер батча.
+
     Параметры:
     -----------
     model : Model
@@ -23,6 +28,10 @@ def generate(
     tokenizer : ByteTokenizer
         Токенизатор, который преобразует текст в токены и наоборот. Используется для
         кодирования начального и декодирования сгенерированного текста.
+    prompts : Optional[List[str]], по умолчанию None
+        Список затравок, по одной на каждую генерируемую последовательность.
+        Если None, генерируется одна последовательность с начала (<bos>)
+        и возвращается строка, как раньше.
     temperature : float, по умолчанию 1.0
         Параметр "температуры", который регулирует степень случайности при генерации.
         При значении 1.0 модель использует стандартное распределение вероятностей.
@@ -32,46 +41,105 @@ def generate(
         Если задано, то модель будет выбирать следующий токен из top_k наиболее вероятных.
         Это ограничивает выбор, делая генерацию текста более управляемой.
     max_length : int, по умолчанию 1024
-        Максимальное количество токенов, которое будет сгенерировано моделью.
+        Максимальное количество токенов, которое будет сгенерировано моделью
+        для каждой последовательности.
+    compile_step : bool, по умолчанию False
+        Если True, шаг декодирования компилируется через torch.compile.
+        Форма входа внутри цикла фиксирована ([B, 1]), поэтому модель
+        компилируется один раз и дальше выполняется без оверхеда Python.
 
     Возвращает:
     -----------
-    str
-        Сгенерированная строка текста, декодированная с помощью токенизатора.
+    Union[str, List[str]]
+        Сгенерированная строка текста (если prompts=None) или список строк,
+        по одной на каждую затравку, декодированных с помощью токенизатора.
     """
     do_sample = temperature > 0
-    gen_ids = []
-    hx = None
-    tokens = torch.tensor([tokenizer.bos_token_id], dtype=torch.long)
+    # Батч контекстов: <bos> + закодированная затравка для каждой последовательности
+    contexts = [[tokenizer.bos_token_id] + (tokenizer.encode(prompt) if prompt else [])
+                for prompt in (prompts if prompts is not None else [''])]
+    batch_size = len(contexts)
+    # active[i] == True, пока последовательность i не встретила <eos> и не достигла max_length
+    active = torch.ones(batch_size, dtype=torch.bool)
+    # Сгенерированные токены и маски активности накапливаем тензорами на устройстве;
+    # на хост они переносятся одним вызовом уже после цикла генерации
+    step_tokens = []
+    step_masks = []
 
     model.eval()
-    while len(gen_ids) < max_length:
-        with torch.no_grad():
-            # Получаем логиты следующего токена и следующее состояние
-            logits, hx = model(tokens, hx)
-            
-            if not do_sample:
-                # Выбираем наиболее вероятный токен (аргмакс)
-                new_token = torch.argmax(logits, dim=-1).item()
+
+    # Компилируем только шаг внутри цикла: у него статичная форма входа [B, 1],
+    # так что компиляция случается единожды. Префилл идет в eager-режиме,
+    # иначе каждая новая длина контекста вызывала бы рекомпиляцию
+    step_model = torch.compile(model, dynamic=False) if compile_step else model
+
+    # Префилл: прогоняем контексты (разной длины) по одному, чтобы получить
+    # логиты следующего токена и стек скрытых состояний для всего батча
+    logits_rows, h_rows, c_rows = [], [], []
+    for context in contexts:
+        out, (h_n, c_n) = model(torch.tensor([context], dtype=torch.long), None)
+        logits_rows.append(out[0, -1])
+        h_rows.append(h_n)
+        c_rows.append(c_n)
+    logits = torch.stack(logits_rows)  # [B, V]
+    hx = (torch.cat(h_rows, dim=1), torch.cat(c_rows, dim=1))
+
+    if top_k is not None:
+        # torch.topk требует k <= V, поэтому ограничиваем top_k размером словаря
+        top_k = min(top_k, logits.size(-1))
+
+    # Скалярный тензор eos и буфер для шума Гамбеля создаем один раз и
+    # переиспользуем на каждом шаге, чтобы не выделять память в цикле
+    eos_token = torch.tensor(tokenizer.eos_token_id)
+    if do_sample:
+        noise = torch.empty(
+            (batch_size, top_k if top_k is not None else logits.size(-1)),
+            dtype=logits.dtype
+        )
+
+    for _ in range(max_length):
+        if not do_sample:
+            # Выбираем наиболее вероятный токен (аргмакс) для каждой строки батча
+            new_tokens = torch.argmax(logits, dim=-1)  # [B]
+        else:
+            # Сэмплируем по Gumbel-max: argmax(logits / T + Gumbel(0, 1)) эквивалентен
+            # multinomial(softmax(logits / T)), но не требует нормализации softmax.
+            # Деление logits /= T на месте портило бы выход модели (logits - вид
+            # на него), поэтому масштабируем шум: argmax(l / T + g) == argmax(l + T * g)
+            # Gumbel(0, 1) == -log(Exp(1)); заполняем буфер шума на месте
+            gumbel = noise.exponential_().log_().neg_()
+            if top_k is not None:
+                # Выбираем top_k наиболее вероятных токенов и сэмплируем среди них
+                values, top_k_indices = torch.topk(logits, top_k, dim=-1)
+                pick = torch.argmax(values + temperature * gumbel, dim=-1, keepdim=True)
+                new_tokens = top_k_indices.gather(-1, pick).squeeze(-1)
             else:
-                logits /= temperature
-                # Получаем вероятностное распределение следующего токена
-                p = F.softmax(logits, dim=-1)[0].numpy()  # Применяем softmax к логитам
-                ids = np.arange(len(p))  # Индексы всех токенов
+                # Если top_k не задан, сэмплируем на основе всех логитов
+                new_tokens = torch.argmax(logits + temperature * gumbel, dim=-1)
 
-                if top_k is not None:
-                    # Выбираем top_k наиболее вероятных токенов
-                    top_k_indices = np.argpartition(p, -top_k)[-top_k:]  # Находим индексы top_k токенов
-                    p = p[top_k_indices]  # Вероятности для top_k
-                    p /= p.sum()  # Нормализуем вероятности
-                    new_token = np.random.choice(top_k_indices, p=p)  # Выбираем из top_k
-                else:
-                    # Если top_k не задан, просто выбираем на основе всех вероятностей
-                    new_token = np.random.choice(ids, p=p)
+        # Обновляем маску активных последовательностей и откладываем токены с маской
+        # на устройстве; hx и вовсе не покидает устройство между шагами
+        active = active & (new_tokens != eos_token)
+        step_tokens.append(new_tokens)
+        step_masks.append(active)
 
-        if new_token == tokenizer.eos_token_id:
+        # Единственная синхронизация с хостом на шаг - скалярная проверка выхода из цикла
+        if not active.any():
             break
-        gen_ids.append(new_token)
-        tokens = torch.tensor([new_token], dtype=torch.long)
 
-    return tokenizer.decode(gen_ids)
\ No newline at end of file
+        # Следующий вход модели - по одному токену на последовательность
+        logits, hx = step_model(new_tokens.unsqueeze(1), hx)
+        logits = logits[:, -1, :]
+
+    # Один перенос на хост для всех шагов сразу: [B, T] токенов и масок
+    gen_ids: List[List[int]] = [[] for _ in range(batch_size)]
+    if step_tokens:
+        tokens_per_row = torch.stack(step_tokens, dim=1).tolist()
+        keep_per_row = torch.stack(step_masks, dim=1).tolist()
+        gen_ids = [
+            [token for token, keep in zip(row, keeps) if keep]
+            for row, keeps in zip(tokens_per_row, keep_per_row)
+        ]
+
+    texts = [tokenizer.decode(ids) for ids in gen_ids]
+    return texts if prompts is not None else texts[0]
@@ -1,4 +1,8 @@
-from typing import List, Tuple, Dict
+import heapq
+import multiprocessing
+from collections import Counter
+from typing import List, Tuple, Dict, Optional
+import numpy as np
 from tqdm import tqdm
 
 class ByteTokenizer:
@@ -25,13 +29,17 @@ class ByteTokenizer:
         Идентификатор токена конца последовательности, назначается при инициализации словаря.
     special_tokens : List[bytes]
         Список специальных токенов, включающий pad_token, bos_token и eos_token.
-    vocab : dict
-        Словарь для сопоставления индексов и байтовых значений символов.
+    vocab : List[bytes]
+        Список байтовых значений токенов; идентификатор токена - его индекс в списке.
+    token_to_id : Dict[bytes, int]
+        Обратное отображение из байтового представления токена в его идентификатор.
+        Поддерживается в актуальном состоянии при расширении словаря.
 
     Методы:
     -------
     init_vocab() -> None
-        Инициализирует словарь (vocab), где ключами являются индексы, а значениями — байтовые представления символов.
+        Инициализирует словарь (vocab) - список, где позиция является идентификатором токена,
+        а значение — его байтовым представлением.
     train(texts: List[str], max_vocab: int) -> None
         Переинициализирует словарь (переопределяется в потомках).
     encode(text: str) -> List[int]
@@ -64,19 +72,22 @@ class ByteTokenizer:
         self.bos_token_id = None
         self.eos_token_id = None
         self.special_tokens = [self.pad_token, self.bos_token, self.eos_token]
-        self.vocab = {}
+        self.vocab = []
+        self.token_to_id = {}
         self.init_vocab()
 
     def init_vocab(self) -> None:
         """Инициализирует словарь для токенизации, добавляя байтовые представления символов и специальные токены."""
-        self.vocab = {idx: bytes([idx]) for idx in range(256)}
-        for token in self.special_tokens:
-            idx = len(self.vocab)
-            self.vocab[idx] = token
-        token_to_id = {y: x for x, y in self.vocab.items()}
-        self.pad_token_id = token_to_id[self.pad_token]
-        self.bos_token_id = token_to_id[self.bos_token]
-        self.eos_token_id = token_to_id[self.eos_token]
+        # Идентификаторы токенов занимают сплошной диапазон 0..N-1, поэтому словарь
+        # хранится плоским списком: доступ по идентификатору - индексация без хэширования
+        self.vocab = [bytes([idx]) for idx in range(256)]
+        self.vocab.extend(self.special_tokens)
+        # Обратное отображение строится один раз и дальше пополняется вместе со словарем,
+        # а не пересобирается с нуля при каждом обращении
+        self.token_to_id = {token: idx for idx, token in enumerate(self.vocab)}
+        self.pad_token_id = self.token_to_id[self.pad_token]
+        self.bos_token_id = self.token_to_id[self.bos_token]
+        self.eos_token_id = self.token_to_id[self.eos_token]
 
     def train(self, texts: List[str], max_vocab: int) -> None:
         """Тренирует токенизатор на данных текстах, переинициализируя словарь (пока без дополнительной логики)."""
@@ -110,8 +121,14 @@ class ByteTokenizer:
         str
             Декодированная строка.
         """
-        text = b''.join(self.vocab[idx] for idx in ids).decode('utf-8', errors='replace')
-        return text
+        try:
+            # Если все идентификаторы - "сырые" байты (< 256), строим буфер одним
+            # вызовом bytes(ids), без поэлементных обращений к словарю
+            data = bytes(ids)
+        except ValueError:
+            # Есть специальные или склеенные токены - собираем по словарю
+            data = b''.join(self.vocab[idx] for idx in ids)
+        return data.decode('utf-8', errors='replace')
 
     def get_vocab_size(self) -> int:
         """Возвращает количество уникальных символов и токенов в словаре.
@@ -140,15 +157,23 @@ def count_pairs(data: List[List[int]]) -> Dict[Tuple[int, int], int]:
     Пример:
     -------
     >>> data = [[1, 2, 3], [2, 3, 4], [1, 2, 2]]
-    >>> count_pairs(data)
-    {(1, 2): 2, (2, 3): 2, (3, 4): 1, (2, 2): 1}
+    >>> dict(count_pairs(data))
+    {(1, 2): 2, (2, 2): 1, (2, 3): 2, (3, 4): 1}
     """
-    pairs = {}
+    # Упаковываем каждую пару соседей в один int64 (старшие 32 бита - левый токен)
+    # и считаем количества векторизованно через np.unique, без обхода пар в Python
+    keys = []
     for ids in data:
-        for i in range(len(ids) - 1):
-            pair = (ids[i], ids[i + 1])
-            pairs[pair] = pairs.get(pair, 0) + 1
-    return pairs
+        if len(ids) > 1:
+            arr = np.asarray(ids, dtype=np.int64)
+            keys.append((arr[:-1] << 32) | arr[1:])
+    if not keys:
+        return Counter()
+    unique, counts = np.unique(np.concatenate(keys), return_counts=True)
+    return Counter({
+        (key >> 32, key & 0xFFFFFFFF): count
+        for key, count in zip(unique.tolist(), counts.tolist())
+    })
 
 
 def merge(numbers: List[int], pair: Tuple[int, int], idx: int) -> List[int]:
@@ -156,10 +181,13 @@ def merge(numbers: List[int], pair: Tuple[int, int], idx: int) -> List[int]:
     Двигаясь слева направо, заменяет все вхождения заданной пары чисел в массиве на заданный индекс.
     Гарантируется, что заданный индекс не встречается в массиве чисел.
 
+    Замена выполняется на месте двумя указателями (чтение/запись), без выделения
+    нового списка; хвост усекается одним del.
+
     Параметры:
     ----------
     numbers : List[int]
-        Список целых чисел.
+        Список целых чисел. Модифицируется на месте.
     pair : Tuple[int, int]
         Пара целых чисел, которую необходимо найти и заменить.
     idx : int
@@ -168,7 +196,7 @@ def merge(numbers: List[int], pair: Tuple[int, int], idx: int) -> List[int]:
     Возвращает:
     -----------
     List[int]
-        Новый список, где каждая найденная пара заменена на значение idx.
+        Тот же список, где каждая найденная пара заменена на значение idx.
 
     Примеры:
     -------
@@ -184,12 +212,95 @@ def merge(numbers: List[int], pair: Tuple[int, int], idx: int) -> List[int]:
     >>> merge([0, 0, 0, 1], (0, 0), 2)
     [2, 0, 1]
     """
+    a, b = pair
+    n = len(numbers)
+    write = 0
+    read = 0
+    while read < n:
+        if read < n - 1 and numbers[read] == a and numbers[read + 1] == b:
+            numbers[write] = idx
+            read += 2  # Пропускаем следующий элемент, так как он уже обработан
+        else:
+            numbers[write] = numbers[read]
+            read += 1
+        write += 1
+    del numbers[write:]
+    return numbers
+
+
+def _encode_and_count(texts: List[str]) -> Tuple[List[List[int]], Dict[Tuple[int, int], int]]:
+    """
+    Кодирует кусок корпуса в байты и считает пары соседних токенов.
+
+    Вынесено в функцию уровня модуля, чтобы ее можно было выполнять
+    в отдельных процессах через multiprocessing.Pool.
+
+    Параметры:
+    ----------
+    texts : List[str]
+        Кусок корпуса (список текстов).
+
+    Возвращает:
+    -----------
+    Tuple[List[List[int]], Dict[Tuple[int, int], int]]
+        Закодированные последовательности и счетчики пар по этому куску.
+    """
+    list_of_ids = [list(text.encode('utf-8')) for text in texts]
+    return list_of_ids, count_pairs(list_of_ids)
+
+
+def _merge_with_counts(
+        numbers: List[int],
+        pair: Tuple[int, int],
+        idx: int,
+        counts: Dict[Tuple[int, int], int]
+) -> List[int]:
+    """
+    То же, что merge, но дополнительно поддерживает словарь счетчиков пар в актуальном
+    состоянии: для каждого склеивания уменьшает счетчики исчезнувших пар (сама пара и
+    пары с соседями) и увеличивает счетчики появившихся пар с новым токеном.
+    Это позволяет не пересчитывать count_pairs по всему корпусу после каждого склеивания.
+
+    Параметры:
+    ----------
+    numbers : List[int]
+        Список целых чисел.
+    pair : Tuple[int, int]
+        Пара целых чисел, которую необходимо найти и заменить.
+    idx : int
+        Значение, на которое заменяется найденная пара.
+    counts : Dict[Tuple[int, int], int]
+        Счетчики пар по всему корпусу; обновляются на месте. Пары с нулевым
+        счетчиком удаляются.
+
+    Возвращает:
+    -----------
+    List[int]
+        Новый список, где каждая найденная пара заменена на значение idx.
+    """
+    def decrement(p: Tuple[int, int]) -> None:
+        counts[p] -= 1
+        if not counts[p]:
+            del counts[p]
+
+    a, b = pair
     result = []
     i = 0
-    while i < len(numbers):
-        if i < len(numbers) - 1 and (numbers[i], numbers[i + 1]) == pair:
+    n = len(numbers)
+    while i < n:
+        if i < n - 1 and numbers[i] == a and numbers[i + 1] == b:
+            # Пары с левым и правым соседями исчезают, вместо них появляются
+            # пары с новым токеном; левого соседа берем из result, так как он
+            # уже мог быть склеен на этом же проходе
+            if result:
+                decrement((result[-1], a))
+                counts[(result[-1], idx)] = counts.get((result[-1], idx), 0) + 1
+            if i + 2 < n:
+                decrement((b, numbers[i + 2]))
+                counts[(idx, numbers[i + 2])] = counts.get((idx, numbers[i + 2]), 0) + 1
+            decrement(pair)
             result.append(idx)
-            i += 2  # Пропускаем следующий элемент, так как он уже обработан
+            i += 2
         else:
             result.append(numbers[i])
             i += 1
@@ -213,9 +324,10 @@ class BpeTokenizer(ByteTokenizer):
     -------
     init_vocab() -> None
         Переинициализирует словарь, добавляя таблицу склеиваний BPE.
-    train(texts: List[str], max_vocab: int) -> None
+    train(texts: List[str], max_vocab: int, num_workers: Optional[int] = None) -> None
         Тренирует BPE-токенизатор, находя наиболее частотные пары токенов и склеивая их,
-        пока не будет достигнут заданный размер словаря.
+        пока не будет достигнут заданный размер словаря. При num_workers > 1 кодирование
+        корпуса и первичный подсчет пар распараллеливаются по процессам.
     encode(text: str) -> List[int]
         Преобразует строку в список байтов с применением BPE для наиболее частотных пар токенов.
 
@@ -235,11 +347,16 @@ class BpeTokenizer(ByteTokenizer):
     >>> print(vocab_size)
     263
     """
+    # Сдвиг для упаковки пары (a, b) в один ключ a << _PAIR_SHIFT | b;
+    # 21 бита хватает для словарей до ~2 млн токенов
+    _PAIR_SHIFT = 21
+
     def __init__(self):
         """
         Инициализирует BpeTokenizer, добавляя словарь для хранения склеиваний пар токенов (merges).
         """
         self.merges = {}
+        self._pair_ranks = {}
         super().__init__()
 
     def init_vocab(self) -> None:
@@ -250,9 +367,12 @@ class BpeTokenizer(ByteTokenizer):
         """
         super().init_vocab()
         self.merges = {}
+        # Зеркало merges с упакованными в int ключами для горячего пути encode:
+        # поиск ранга пары не хэширует кортеж и не создает его на каждую проверку
+        self._pair_ranks = {}
 
     
-    def train(self, texts: List[str], max_vocab: int) -> None:
+    def train(self, texts: List[str], max_vocab: int, num_workers: Optional[int] = None) -> None:
         self.init_vocab()
 
         if max_vocab <= len(self.vocab):
@@ -260,15 +380,33 @@ class BpeTokenizer(ByteTokenizer):
 
         progress_bar = tqdm(range(max_vocab - len(self.vocab)))
 
-        list_of_ids = [list(text.encode('utf-8')) for text in texts]
-
+        # Считаем пары один раз, дальше поддерживаем счетчики инкрементально:
+        # каждое склеивание меняет только пары вокруг своих вхождений.
+        # Кодирование корпуса и первичный подсчет можно распараллелить по кускам;
+        # сам цикл склеиваний остается последовательным - пересылка корпуса
+        # между процессами на каждой итерации обошлась бы дороже подсчета
+        if num_workers is not None and num_workers > 1 and len(texts) > 1:
+            workers = min(num_workers, len(texts))
+            chunk_size = (len(texts) + workers - 1) // workers
+            chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+            with multiprocessing.Pool(len(chunks)) as pool:
+                results = pool.map(_encode_and_count, chunks)
+            list_of_ids = []
+            cnt: Counter = Counter()
+            for chunk_ids, chunk_cnt in results:
+                list_of_ids.extend(chunk_ids)
+                cnt.update(chunk_cnt)
+        else:
+            list_of_ids = [list(text.encode('utf-8')) for text in texts]
+            cnt = count_pairs(list_of_ids)
 
         for _ in progress_bar:
-            cnt = count_pairs(list_of_ids)
-            
-            # Находим пару с наибольшей частотой, при одинаковой частоте выбираем пару с большей суммой токенов
-            pair = max(cnt.keys(), key=lambda p: (cnt[p], sum(p)))
-            freq = cnt[pair]
+            if not cnt:
+                break
+
+            # Находим пару с наибольшей частотой, при одинаковой частоте выбираем пару
+            # с большей суммой токенов; один проход по items без повторных обращений к словарю
+            pair, freq = max(cnt.items(), key=lambda item: (item[1], item[0][0] + item[0][1]))
             progress_bar.set_description(f'pair={pair}, freq={freq}')
 
             if freq == 1:
@@ -276,20 +414,61 @@ class BpeTokenizer(ByteTokenizer):
 
             new_idx = len(self.vocab)
             self.merges[pair] = new_idx
-            self.vocab[new_idx] = self.vocab[pair[0]] + self.vocab[pair[1]]
+            self._pair_ranks[pair[0] << self._PAIR_SHIFT | pair[1]] = new_idx
+            merged_token = self.vocab[pair[0]] + self.vocab[pair[1]]
+            self.vocab.append(merged_token)
+            self.token_to_id[merged_token] = new_idx
 
             for i, ids in enumerate(list_of_ids):
-                list_of_ids[i] = merge(ids, pair, new_idx)
+                list_of_ids[i] = _merge_with_counts(ids, pair, new_idx, cnt)
 
 
     def encode(self, text: str) -> List[int]:
         ids = list(text.encode('utf-8'))
-
-        while len(ids) > 1:
-            cnt = count_pairs([ids])
-            pair = max(cnt.keys(), key=lambda p: (cnt[p], sum(p)))
-            if pair not in self.merges:
-                break
-            idx = self.merges[pair]
-            ids = merge(ids, pair, idx)
-        return ids
+        if len(ids) < 2 or not self.merges:
+            return ids
+
+        ranks = self._pair_ranks
+        shift = self._PAIR_SHIFT
+        n = len(ids)
+        # Представляем последовательность связным списком на массивах prev/next:
+        # склеивание пары - это O(1) перестановка указателей, без пересборки списка.
+        # Пары-кандидаты держим в куче по рангу склеивания (меньший индекс в merges
+        # означает более раннее, то есть более приоритетное склеивание)
+        prev = list(range(-1, n - 1))
+        next_ = list(range(1, n + 1))
+        next_[-1] = -1
+        alive = [True] * n
+
+        heap = [(rank, i) for i in range(n - 1)
+                if (rank := ranks.get(ids[i] << shift | ids[i + 1])) is not None]
+        heapq.heapify(heap)
+
+        while heap:
+            rank, i = heapq.heappop(heap)
+            j = next_[i]
+            # Пропускаем устаревшие записи: узел уже склеен или пара изменилась
+            if not alive[i] or j == -1 or ranks.get(ids[i] << shift | ids[j]) != rank:
+                continue
+
+            # Склеиваем j в i: новый токен и есть ранг пары в merges
+            ids[i] = rank
+            alive[j] = False
+            nj = next_[j]
+            next_[i] = nj
+            if nj != -1:
+                prev[nj] = i
+
+            # Новые пары с левым и правым соседями становятся кандидатами
+            pi = prev[i]
+            if pi != -1 and (r := ranks.get(ids[pi] << shift | ids[i])) is not None:
+                heapq.heappush(heap, (r, pi))
+            if nj != -1 and (r := ranks.get(ids[i] << shift | ids[nj])) is not None:
+                heapq.heappush(heap, (r, i))
+
+        result = []
+        i = 0
+        while i != -1:
+            result.append(ids[i])
+            i = next_[i]
+        return result
@@ -62,3 +62,15 @@ class TestTokenizer(TestCase):
             tokenizer.encode('aaaaababcd'),
             [259, 259, 261, 99, 100]
         )
+
+    def test_encode_applies_merges_in_rank_order(self):
+        # encode должен быть эквивалентен последовательному применению склеиваний
+        # в порядке их выучивания (ранга), без подсчета частот пар в тексте
+        tokenizer = BpeTokenizer()
+        tokenizer.train(['aaaaa', 'abababc'], max_vocab=262)
+
+        expected = list('aaaaababcd'.encode('utf-8'))
+        for pair, idx in sorted(tokenizer.merges.items(), key=lambda item: item[1]):
+            expected = merge(expected, pair, idx)
+
+        self.assertEqual(tokenizer.encode('aaaaababcd'), expected)